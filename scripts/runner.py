@@ -2,6 +2,9 @@
 """
 SmartRunner - Self-contained PTY monitor with input gate.
 
+PTY output, input pipe, child exit and status file changes are all served
+from one selector loop; only the slow cron setup runs on a helper thread.
+
 Features:
 - Monitors stdout/stderr for IO_WAIT (2s) and STALL (30s)
 - Triggers AI via Cron on anomalies or periodic heartbeat (5m)
@@ -9,20 +12,95 @@ Features:
 """
 
 import os
+import io
+import re
 import sys
 import time
 import json
 import pty
-import select
+import fcntl
+import termios
+import struct
+import selectors
 import subprocess
+import shlex
 import argparse
 import signal
 import threading
 import stat
+import ctypes
+import ctypes.util
+
+OPENCLAW_PATH = "/home/xcssa/.local/share/fnm/node-versions/v24.13.0/installation/bin/openclaw"
+CRON_LIST_ARGS = ["cron", "list", "--json"]
+
+# inotify event masks (see <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+
+
+class Inotify:
+    """Minimal ctypes wrapper around the Linux inotify API."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._rm_watch = libc.inotify_rm_watch
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def add_watch(self, path, mask):
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed: {path}")
+        return wd
+
+    def rm_watch(self, wd):
+        self._rm_watch(self.fd, wd)
+
+    def read(self):
+        """Drain pending events and return the file names they refer to."""
+        names = []
+        while True:
+            try:
+                buf = os.read(self.fd, 4096)
+            except BlockingIOError:
+                break
+            if not buf:
+                break
+            # struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+            offset = 0
+            while offset + 16 <= len(buf):
+                _, _, _, name_len = struct.unpack_from("iIII", buf, offset)
+                offset += 16
+                names.append(os.fsdecode(buf[offset:offset + name_len].rstrip(b"\0")))
+                offset += name_len
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+# openclaw may print log lines after the JSON document; raw_decode stops at
+# the end of the first object instead of failing on the trailing text
+_JSON_DECODER = json.JSONDecoder()
+
+
+def parse_json_output(output):
+    """Parse CLI output bytes: json.loads on the bytes, raw_decode if there's trailing text."""
+    try:
+        return json.loads(output)
+    except ValueError:
+        obj, _ = _JSON_DECODER.raw_decode(output.decode('utf-8', errors='replace'))
+        return obj
+
 
 class SmartRunner:
-    def __init__(self, cmd, cron_name, cron_payload, working_dir):
+    def __init__(self, cmd, cron_name, cron_payload, working_dir, use_shell=False):
         self.cmd = cmd
+        self.use_shell = use_shell
         self.cron_name = cron_name
         self.cron_payload = cron_payload
         self.working_dir = working_dir
@@ -34,30 +112,111 @@ class SmartRunner:
         self.input_pipe = os.path.join(self.runner_dir, "input.pipe")
         
         self.cron_id = None
+        self._cron_lock = threading.Lock()  # cron_id is set from the setup_cron thread
+        self._cron_ready = threading.Event()  # Set once setup_cron has finished
+        self._cron_thread = None
         self.process = None
         self.master_fd = None
+        self.child_fd = None
+        self.selector = None
+        self.inotify = None
+        self.pty_closed = False
+        self.status_changed = False
         self.running = True
         
         # State
-        self.last_activity_time = time.time()
-        self.last_log_chunk = ""
+        self.last_activity_time = time.monotonic()
+        self.last_log_chunk_tail = b""
         self.state = "MONITORING"
+        self._status_cache_key = None
+        self._status_sig = None
+        self._log_fd = None
+        self._log_buf = None
+        self._log_flush_due = None
+        self._pipe_rfd = None
+        self._pipe_wfd = None
+        self._pending_input = bytearray()
+        self._read_buf = None
+        self._read_view = None
         
         # Constants
         self.STALL_TIMEOUT = 30.0
         self.IO_WAIT_TIMEOUT = 2.0
+        self.POLL_INTERVAL = 0.5  # Fallback when pidfd/inotify are unavailable
+        self.CRON_READY_TIMEOUT = 5.0
+        self.LOG_BUFFER_SIZE = 128 * 1024
+        self.PTY_READ_SIZE = 64 * 1024
+        self.DRAIN_BUDGET = 0.001  # Max time spent reading the PTY per wakeup
+        self.PIPE_READ_SIZE = 64 * 1024
+        self.PTY_ROWS = 50    # Window size used when our stdout is not a terminal
+        self.PTY_COLS = 250
+        self.LOG_FLUSH_INTERVAL = 1.0  # Max staleness of output.log while output is flowing
+        
+        # Cron payload suffix: everything but the child PID is fixed for the
+        # runner's lifetime, so it is formatted once here
+        self._static_instructions_tpl = self.build_instructions_tpl()
+
+    def build_instructions_tpl(self):
+        """Process info + system instructions, with %(pid)s for the child PID."""
+        def esc(value):
+            return str(value).replace("%", "%%")
+        
+        process_info = f"""
+---
+[Process Info]
+- Child PID: %(pid)s
+- Runner PID: {os.getpid()}
+- Working Dir: {esc(self.working_dir)}
+- Runner Dir: {esc(self.runner_dir)}
+- Input Pipe: {esc(self.input_pipe)}"""
+
+        system_instructions = f"""
+---
+[SmartRunner Instructions]
+1. CHECK STATUS: Read {esc(self.status_file)}
+   - "MONITORING": Heartbeat only. Report progress if needed.
+   - "WAITING_FOR_AI": 🚨 ACTION REQUIRED!
+
+2. ANALYZE: Read {esc(self.log_file)} (last ~30 lines)
+
+3. INTERVENE (If needed):
+   - To send input: exec 'echo "your input" > {esc(self.input_pipe)}'
+   - To send special keys: exec 'printf "\\n" > {esc(self.input_pipe)}' (newline)
+   - To send Ctrl+C: exec 'printf "\\x03" > {esc(self.input_pipe)}'
+   - To kill process: exec 'kill %(pid)s'
+
+4. RESUME (CRITICAL):
+   Write {{"state": "AI_DONE"}} to {esc(self.status_file)} after handling.
+   Without this, the runner stays paused!
+"""
+        return process_info + system_instructions
 
     def setup_dirs(self):
         """Initialize runner directory and named pipe."""
-        if os.path.exists(self.runner_dir):
-            import shutil
-            shutil.rmtree(self.runner_dir)
+        # Remove what a previous run left behind; we know every file we create
+        for path in (self.status_file, self.status_file + ".tmp", self.log_file, self.pid_file, self.input_pipe):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        try:
+            os.rmdir(self.runner_dir)
+        except OSError:
+            pass  # Missing, or holds files we didn't create; reuse it
         
-        os.makedirs(self.runner_dir)
+        os.makedirs(self.runner_dir, exist_ok=True)
         
         # Create named pipe for input injection
         os.mkfifo(self.input_pipe)
         os.chmod(self.input_pipe, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IWGRP)
+        # Open it once; our own idle writer keeps it from hitting EOF when
+        # external writers disconnect, so it never needs reopening
+        self._pipe_rfd = os.open(self.input_pipe, os.O_RDONLY | os.O_NONBLOCK)
+        self._pipe_wfd = os.open(self.input_pipe, os.O_WRONLY | os.O_NONBLOCK)
+        
+        # Keep a single buffered append handle on the log
+        self._log_fd = os.open(self.log_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self._log_buf = io.BufferedWriter(io.FileIO(self._log_fd, 'a', closefd=False), buffer_size=self.LOG_BUFFER_SIZE)
         
         # Save PID
         with open(self.pid_file, 'w') as f:
@@ -68,11 +227,23 @@ class SmartRunner:
     def update_status(self, state, reason=None, info=None):
         """Update status file for AI to read."""
         self.state = state
+        child_pid = self.process.pid if self.process else None
+        
+        # Skip building and rewriting the file if nothing changed since our
+        # last write and nobody else has touched it in the meantime
+        key = (state, reason, info, child_pid)
+        if key == self._status_cache_key:
+            try:
+                if self.stat_sig(self.status_file) == self._status_sig:
+                    return
+            except OSError:
+                pass
+        
         data = {
             "state": state,
             "updated_at": time.time(),
             "runner_pid": os.getpid(),
-            "child_pid": self.process.pid if self.process else None,
+            "child_pid": child_pid,
             "cmd": self.cmd,
             "input_pipe": self.input_pipe
         }
@@ -81,20 +252,42 @@ class SmartRunner:
         if info:
             data["info"] = info
         
-        with open(self.status_file, 'w') as f:
-            json.dump(data, f, indent=2)
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        self._status_cache_key = key
+        
+        # Write to a temp file and rename so readers never see a partial file
+        tmp_file = self.status_file + ".tmp"
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, payload)
+        finally:
+            os.close(fd)
+        os.rename(tmp_file, self.status_file)
+        self._status_sig = self.stat_sig(self.status_file)
 
-    def log_output(self, text):
-        """Append output to log file."""
-        with open(self.log_file, 'a', encoding='utf-8') as f:
-            f.write(text)
+    @staticmethod
+    def stat_sig(path):
+        """Cheap change signature for a file: (inode, mtime_ns, size)."""
+        st = os.stat(path)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def log_output(self, data):
+        """Append raw PTY bytes to log file (buffered, see flush_log)."""
+        self._log_buf.write(data)
+        if self._log_flush_due is None:
+            self._log_flush_due = time.monotonic() + self.LOG_FLUSH_INTERVAL
+
+    def flush_log(self):
+        """Push buffered log output to disk so the AI sees it."""
+        if self._log_buf is not None:
+            self._log_buf.flush()
+        self._log_flush_due = None
 
     def run_openclaw_cmd(self, args):
-        """Run an openclaw CLI command and return output."""
+        """Run an openclaw CLI command and return its stripped stdout as bytes."""
         try:
-            openclaw_path = "/home/xcssa/.local/share/fnm/node-versions/v24.13.0/installation/bin/openclaw"
-            cmd = [openclaw_path] + args
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            cmd = [OPENCLAW_PATH] + args
+            result = subprocess.run(cmd, stdin=subprocess.DEVNULL, capture_output=True)
             return result.stdout.strip()
         except Exception as e:
             print(f"[Runner] Error running openclaw cmd: {e}")
@@ -104,70 +297,50 @@ class SmartRunner:
         """Setup cron job for AI triggering."""
         print(f"[Runner] Setting up cron job: {self.cron_name}")
         
-        # Cleanup existing job by name
+        cron_id = None
         try:
-            list_output = self.run_openclaw_cmd(["cron", "list", "--json"])
-            if list_output:
-                jobs_data = json.loads(list_output)
-                jobs = jobs_data if isinstance(jobs_data, list) else jobs_data.get("jobs", [])
-                for job in jobs:
-                    if job.get("name") == self.cron_name:
-                        job_id = job.get("id") or job.get("jobId")
+            # Cleanup existing job by name
+            try:
+                list_output = self.run_openclaw_cmd(CRON_LIST_ARGS)
+                if list_output:
+                    jobs_data = parse_json_output(list_output)
+                    jobs = jobs_data if isinstance(jobs_data, list) else jobs_data.get("jobs", [])
+                    name_to_ids = {}
+                    for job in jobs:
+                        name_to_ids.setdefault(job.get("name"), []).append(job.get("id") or job.get("jobId"))
+                    for job_id in name_to_ids.get(self.cron_name, []):
                         print(f"[Runner] Removing old cron job: {job_id}")
                         self.run_openclaw_cmd(["cron", "rm", job_id])
-        except Exception as e:
-            print(f"[Runner] Error during cron cleanup: {e}")
-
-        # Build payload with process info and instructions
-        process_info = f"""
----
-[Process Info]
-- Child PID: {self.process.pid}
-- Runner PID: {os.getpid()}
-- Working Dir: {self.working_dir}
-- Runner Dir: {self.runner_dir}
-- Input Pipe: {self.input_pipe}"""
-
-        system_instructions = f"""
----
-[SmartRunner Instructions]
-1. CHECK STATUS: Read {self.status_file}
-   - "MONITORING": Heartbeat only. Report progress if needed.
-   - "WAITING_FOR_AI": 🚨 ACTION REQUIRED!
-
-2. ANALYZE: Read {self.log_file} (last ~30 lines)
-
-3. INTERVENE (If needed):
-   - To send input: exec 'echo "your input" > {self.input_pipe}'
-   - To send special keys: exec 'printf "\\n" > {self.input_pipe}' (newline)
-   - To send Ctrl+C: exec 'printf "\\x03" > {self.input_pipe}'
-   - To kill process: exec 'kill {self.process.pid}'
+            except Exception as e:
+                print(f"[Runner] Error during cron cleanup: {e}")
 
-4. RESUME (CRITICAL):
-   Write {{"state": "AI_DONE"}} to {self.status_file} after handling.
-   Without this, the runner stays paused!
-"""
-        full_payload = self.cron_payload + process_info + system_instructions
-        
-        add_cmd = [
-            "cron", "add",
-            "--name", self.cron_name,
-            "--every", "5m",
-            "--session", "main",
-            "--system-event", full_payload,
-            "--json"
-        ]
-        
-        output = self.run_openclaw_cmd(add_cmd)
-        if output:
-            try:
-                job_data = json.loads(output)
-                self.cron_id = job_data.get("id") or job_data.get("jobId")
-                print(f"[Runner] Cron job created: {self.cron_id}")
-            except:
-                print(f"[Runner] Failed to parse cron output: {output}")
+            # Only the child PID is filled in per run; the rest was built in __init__
+            full_payload = self.cron_payload + self._static_instructions_tpl % {"pid": self.process.pid}
+            
+            add_cmd = [
+                "cron", "add",
+                "--name", self.cron_name,
+                "--every", "5m",
+                "--session", "main",
+                "--system-event", full_payload,
+                "--json"
+            ]
+            
+            output = self.run_openclaw_cmd(add_cmd)
+            if output:
+                try:
+                    job_data = parse_json_output(output)
+                    cron_id = job_data.get("id") or job_data.get("jobId")
+                    print(f"[Runner] Cron job created: {cron_id}")
+                except (ValueError, AttributeError) as e:
+                    print(f"[Runner] Failed to parse cron output ({e}): {output.decode('utf-8', errors='replace')}")
+        finally:
+            # Always publish, even on error, so trigger_ai never waits in vain
+            with self._cron_lock:
+                self.cron_id = cron_id
+            self._cron_ready.set()
         
-        if not self.cron_id:
+        if not cron_id:
             print("[Runner] WARNING: Failed to setup cron job!")
 
     def trigger_ai(self, reason):
@@ -176,137 +349,378 @@ class SmartRunner:
             return
             
         print(f"[Runner] Triggering AI. Reason: {reason}")
+        
+        # Watch before publishing WAITING_FOR_AI so no response can slip past
+        wd = None
+        if self.inotify:
+            try:
+                wd = self.inotify.add_watch(self.runner_dir, IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_TO)
+            except OSError as e:
+                print(f"[Runner] inotify watch failed, polling status: {e}")
+        
+        self.flush_log()
         self.update_status("WAITING_FOR_AI", reason=reason)
         
-        if self.cron_id:
-            self.run_openclaw_cmd(["cron", "run", "--force", self.cron_id])
+        # An early IO_WAIT can race the background cron setup; give it a moment
+        if not self._cron_ready.wait(timeout=self.CRON_READY_TIMEOUT):
+            print("[Runner] Cron setup still in progress...")
+        with self._cron_lock:
+            cron_id = self.cron_id
+        if cron_id:
+            self.run_openclaw_cmd(["cron", "run", "--force", cron_id])
         else:
             print("[Runner] Cannot trigger AI: No Cron ID")
 
         # Wait for AI response while draining PTY output
         print("[Runner] Waiting for AI...")
-        while self.running:
-            # Keep draining output
-            if self.master_fd is not None:
-                try:
-                    r, _, _ = select.select([self.master_fd], [], [], 0.5)
-                    if self.master_fd in r:
-                        data = os.read(self.master_fd, 10240)
-                        if data:
-                            text = data.decode('utf-8', errors='replace')
-                            sys.stdout.write(text)
-                            sys.stdout.flush()
-                            self.log_output(text)
-                except OSError:
-                    pass
-            else:
-                time.sleep(0.5)
-            
-            # Check if AI responded
+        last_sig = self._status_sig
+        self.status_changed = True  # Check once for responses that beat the watch
+        try:
+            while self.running:
+                # Check if AI responded. With inotify, only after status.json
+                # was written; without it, whenever the stat signature moved
+                if self.status_changed or wd is None:
+                    self.status_changed = False
+                    try:
+                        sig = self.stat_sig(self.status_file)
+                        if sig != last_sig:
+                            last_sig = sig
+                            with open(self.status_file, 'rb') as f:
+                                data = json.load(f)
+                            if data.get("state") == "AI_DONE":
+                                print("[Runner] AI finished. Resuming...")
+                                self.update_status("MONITORING", info="Resumed after AI intervention")
+                                self.last_activity_time = time.monotonic()
+                                self.last_log_chunk_tail = b""
+                                break
+                    except (OSError, ValueError, AttributeError):
+                        pass
+                
+                timeout = None if wd is not None else self.POLL_INTERVAL
+                self.poll_events(timeout)
+        finally:
+            if wd is not None:
+                self.inotify.rm_watch(wd)
+
+    def poll_events(self, timeout):
+        """Wait for events and dispatch them, flushing the log once it is due."""
+        if self._log_flush_due is not None:
+            flush_in = max(self._log_flush_due - time.monotonic(), 0)
+            timeout = flush_in if timeout is None else min(timeout, flush_in)
+        self.dispatch(self.selector.select(timeout))
+        if self._log_flush_due is not None and time.monotonic() >= self._log_flush_due:
+            self.flush_log()
+
+    def dispatch(self, events):
+        """Invoke the handler registered for each ready fd."""
+        for key, mask in events:
+            key.data(mask)
+
+    def on_pty_ready(self, mask):
+        """Flush queued input to the child and forward its output."""
+        if mask & selectors.EVENT_WRITE:
+            self.write_input()
+        if mask & selectors.EVENT_READ:
+            self.read_pty()
+
+    def read_pty(self):
+        """
+        Drain the PTY into the reusable read buffer until EAGAIN, or until
+        DRAIN_BUDGET runs out so a firehose child can't starve the other
+        fds; whatever is left keeps the master readable for the next round.
+        """
+        read_any = False
+        eof = False
+        drain_until = time.monotonic() + self.DRAIN_BUDGET
+        while True:
             try:
-                with open(self.status_file, 'r') as f:
-                    data = json.load(f)
-                    if data.get("state") == "AI_DONE":
-                        print("[Runner] AI finished. Resuming...")
-                        self.update_status("MONITORING", info="Resumed after AI intervention")
-                        self.last_activity_time = time.time()
-                        self.last_log_chunk = ""
-                        break
-            except:
-                pass
+                n = os.readv(self.master_fd, [self._read_buf])
+            except BlockingIOError:
+                break
+            except OSError:
+                n = 0
+            if not n:
+                eof = True
+                break
+            # Both sinks copy into their own buffers, so the view can be reused
+            chunk = self._read_view[:n]
+            sys.stdout.buffer.write(chunk)
+            self.log_output(chunk)
+            self.last_log_chunk_tail = self._read_buf[n - 1:n]  # Only the last byte matters for IO_WAIT
+            read_any = True
+            if time.monotonic() >= drain_until:
+                break
+        
+        if read_any:
+            sys.stdout.buffer.flush()
+            self.last_activity_time = time.monotonic()
+        
+        if eof:
+            # Child side closed; stop watching to avoid spinning on EIO
+            self.selector.unregister(self.master_fd)
+            self.pty_closed = True
 
-    def input_gate_thread(self):
+    def write_input(self, bufs=()):
         """
-        Monitor named pipe for input injection.
-        Runs in a separate thread, forwarding pipe data to child PTY.
+        Queue bytes for the child and write as much as the PTY accepts.
+        The master is non-blocking, so leftovers wait for EVENT_WRITE.
         """
-        print(f"[Runner] Input gate listening: {self.input_pipe}")
-        while self.running:
+        if self.pty_closed:
+            return
+        if bufs:
+            if self._pending_input:
+                self._pending_input.extend(b"".join(bufs))
+                return
+            pending = list(bufs)
+        else:
+            pending = [self._pending_input]
+        
+        total = sum(len(b) for b in pending)
+        try:
+            written = os.writev(self.master_fd, pending)
+        except BlockingIOError:
+            written = 0
+        except OSError:
+            written = total  # Child gone; drop the input
+        
+        self._pending_input = bytearray(b"".join(pending)[written:]) if written < total else bytearray()
+        events = selectors.EVENT_READ
+        if self._pending_input:
+            events |= selectors.EVENT_WRITE
+        self.selector.modify(self.master_fd, events, self.on_pty_ready)
+
+    def on_pipe_readable(self, mask):
+        """Forward data written to the input pipe to the child PTY."""
+        # Drain everything queued so far, then hand it over in one writev
+        bufs = []
+        while True:
             try:
-                # Open pipe in read mode (blocks until writer connects)
-                with open(self.input_pipe, 'r') as pipe:
-                    while self.running:
-                        data = pipe.read(1024)
-                        if not data:
-                            break  # Writer closed, reopen pipe
-                        if self.master_fd is not None:
-                            os.write(self.master_fd, data.encode('utf-8'))
-                            print(f"[Runner] Injected input: {repr(data)}")
-            except Exception as e:
-                if self.running:
-                    print(f"[Runner] Input gate error: {e}")
-                    time.sleep(0.5)
+                chunk = os.read(self._pipe_rfd, self.PIPE_READ_SIZE)
+            except BlockingIOError:
+                break
+            if not chunk:
+                break
+            bufs.append(chunk)
+        if bufs and self.master_fd is not None:
+            self.write_input(bufs)
+            data = b"".join(bufs)
+            print(f"[Runner] Injected input: {repr(data.decode('utf-8', errors='replace'))}")
+
+    def on_child_exit(self, mask):
+        """pidfd became readable: child has exited."""
+        self.selector.unregister(self.child_fd)
+
+    def on_inotify(self, mask):
+        if os.path.basename(self.status_file) in self.inotify.read():
+            self.status_changed = True
+
+    def next_deadline(self):
+        """Monotonic time at which the next IO_WAIT/STALL check is due."""
+        if self.last_log_chunk_tail and self.last_log_chunk_tail != b'\n':
+            return self.last_activity_time + self.IO_WAIT_TIMEOUT
+        return self.last_activity_time + self.STALL_TIMEOUT
 
     def run(self):
         """Main entry point."""
+        # Child output goes to sys.stdout.buffer directly; keep our own
+        # messages from lingering in the text layer and coming out of order
+        sys.stdout.reconfigure(line_buffering=True)
+        
+        # Exec the command directly unless shell features were asked for,
+        # so no intermediate /bin/sh sits between us and the child
+        if self.use_shell:
+            argv = self.cmd
+        else:
+            try:
+                argv = shlex.split(self.cmd)
+                syntax = self.shell_syntax(self.cmd)
+            except ValueError as e:
+                print(f"[Runner] Cannot parse command: {e}")
+                return 1
+            if syntax:
+                print(f"[Runner] --cmd contains shell syntax ({' '.join(syntax)}); rerun with --shell")
+                return 1
+            if not argv:
+                print("[Runner] Nothing to run")
+                return 1
+        
         self.setup_dirs()
         
         # Create PTY
         self.master_fd, slave_fd = pty.openpty()
+        self._read_buf = bytearray(self.PTY_READ_SIZE)
+        self._read_view = memoryview(self._read_buf)
+        os.set_blocking(self.master_fd, False)
+        self.set_winsize(slave_fd)
         
         print(f"[Runner] Starting: {self.cmd}")
-        self.process = subprocess.Popen(
-            self.cmd,
-            shell=True,
-            stdin=slave_fd,
-            stdout=slave_fd,
-            stderr=slave_fd,
-            close_fds=True,
-            preexec_fn=os.setsid
-        )
+        try:
+            self.process = subprocess.Popen(
+                argv,
+                shell=self.use_shell,
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                close_fds=True,
+                start_new_session=True
+            )
+        except OSError as e:
+            print(f"[Runner] Failed to start command: {e}")
+            os.close(slave_fd)
+            self.cleanup()
+            return 1
         os.close(slave_fd)
         
         # Update status with child PID
         self.update_status("MONITORING", info="Process started")
         
-        # Setup cron in background (slow CLI call)
-        cron_thread = threading.Thread(target=self.setup_cron, daemon=True)
-        cron_thread.start()
+        # Event sources: PTY output, child exit (pidfd) and status file changes (inotify)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.master_fd, selectors.EVENT_READ, self.on_pty_ready)
+        self.selector.register(self._pipe_rfd, selectors.EVENT_READ, self.on_pipe_readable)
+        if hasattr(os, "pidfd_open"):
+            try:
+                self.child_fd = os.pidfd_open(self.process.pid)
+                self.selector.register(self.child_fd, selectors.EVENT_READ, self.on_child_exit)
+            except OSError:
+                self.child_fd = None
+        try:
+            self.inotify = Inotify()
+            self.selector.register(self.inotify.fd, selectors.EVENT_READ, self.on_inotify)
+        except (OSError, AttributeError):
+            self.inotify = None
         
-        # Start input gate thread
-        input_thread = threading.Thread(target=self.input_gate_thread, daemon=True)
-        input_thread.start()
+        # Setup cron in background (slow CLI call)
+        self._cron_thread = threading.Thread(target=self.setup_cron, daemon=True)
+        self._cron_thread.start()
         
+        print(f"[Runner] Input gate listening: {self.input_pipe}")
         print(f"[Runner] Monitoring PID {self.process.pid}...")
-        self.last_activity_time = time.time()
+        self.last_activity_time = time.monotonic()
         
         try:
-            while self.process.poll() is None:
-                r, _, _ = select.select([self.master_fd], [], [], 0.5)
-                
-                if self.master_fd in r:
-                    try:
-                        data = os.read(self.master_fd, 10240)
-                    except OSError:
-                        break
-                        
-                    if data:
-                        text = data.decode('utf-8', errors='replace')
-                        sys.stdout.write(text)
-                        sys.stdout.flush()
-                        self.log_output(text)
-                        
-                        self.last_activity_time = time.time()
-                        self.last_log_chunk = text
+            while self.process.poll() is None and not self.pty_closed:
+                timeout = max(self.next_deadline() - time.monotonic(), 0)
+                if self.child_fd is None:
+                    timeout = min(timeout, self.POLL_INTERVAL)
+                self.poll_events(timeout)
+                if self.pty_closed:
+                    break
                 
                 # Check timers
-                now = time.time()
+                now = time.monotonic()
                 elapsed = now - self.last_activity_time
                 
                 # IO Wait: short timeout + no trailing newline
-                if elapsed > self.IO_WAIT_TIMEOUT and self.last_log_chunk and not self.last_log_chunk.endswith('\n'):
+                if elapsed >= self.IO_WAIT_TIMEOUT and self.last_log_chunk_tail and self.last_log_chunk_tail != b'\n':
                     self.trigger_ai("IO_WAIT")
-                    self.last_log_chunk = ""
+                    self.last_log_chunk_tail = b""
                 
                 # Stall: long timeout
-                elif elapsed > self.STALL_TIMEOUT:
+                elif elapsed >= self.STALL_TIMEOUT:
                     self.trigger_ai("STALL")
-                    self.last_activity_time = time.time()
+                    self.last_activity_time = time.monotonic()
+            
+            # Drain output the child wrote right before exiting
+            drain_until = time.monotonic() + self.POLL_INTERVAL
+            while not self.pty_closed and time.monotonic() < drain_until:
+                events = [(key, mask) for key, mask in self.selector.select(0) if key.fd == self.master_fd]
+                if not events:
+                    break
+                self.dispatch(events)
+            
+            # EOF on the PTY usually means the child is exiting; reap it
+            # rather than having cleanup kill it
+            if self.process.poll() is None:
+                try:
+                    self.process.wait(timeout=self.POLL_INTERVAL)
+                except subprocess.TimeoutExpired:
+                    pass
+            exit_code = self.process.returncode
                     
         except KeyboardInterrupt:
             print("\n[Runner] Interrupted")
+            exit_code = None
         finally:
             self.cleanup()
+        
+        # Child's own status; 1 if it was killed by a signal or by us
+        if exit_code is None or exit_code < 0:
+            return 1
+        return exit_code
+
+    @staticmethod
+    def shell_syntax(cmd):
+        """
+        Shell syntax in cmd that shlex.split would pass through literally:
+        operators (| & ; < > ( )), $ and backtick expansion, globs (* ? [),
+        a leading ~ and a leading NAME= assignment. Scans with the same POSIX
+        quoting rules as shlex.split, so quoted/escaped characters don't count.
+        """
+        found = []
+        operator = ""        # Run of operator chars, reported as one token (&&, 2>&1 -> >&)
+        quote = None
+        escaped = False
+        word = ""            # Unquoted text of the current word so far
+        word_quoted = False
+        in_word = False
+        word_index = 0
+        for ch in cmd:
+            if operator and (quote or escaped or ch not in "|&;<>()"):
+                found.append(operator)
+                operator = ""
+            if escaped:
+                escaped = False
+                continue
+            if quote == "'":
+                if ch == "'":
+                    quote = None
+                continue
+            if quote == '"':
+                if ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    quote = None
+                elif ch in "$`":
+                    found.append(ch)
+                continue
+            
+            if ch == "\\" or ch in "'\"":
+                escaped = ch == "\\"
+                quote = None if escaped else ch
+                in_word = word_quoted = True
+                continue
+            if ch.isspace() or ch in "|&;<>()":
+                if ch in "|&;<>()":
+                    operator += ch
+                if in_word:
+                    word_index += 1
+                word, word_quoted, in_word = "", False, False
+                continue
+            
+            if ch in "$`*?[":
+                found.append(ch)
+            elif ch == "~" and not in_word:
+                found.append("~")
+            elif ch == "=" and word_index == 0 and not word_quoted and re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", word):
+                found.append(word + "=")
+            word += ch
+            in_word = True
+        if operator:
+            found.append(operator)
+        return list(dict.fromkeys(found))
+
+    def set_winsize(self, fd):
+        """Size the child's terminal: mirror ours, else a wide default."""
+        try:
+            size = os.get_terminal_size(sys.stdout.fileno())
+            rows, cols = size.lines, size.columns
+        except (OSError, ValueError):
+            rows, cols = self.PTY_ROWS, self.PTY_COLS
+        try:
+            fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+        except OSError:
+            pass
 
     def cleanup(self):
         """Clean up resources."""
@@ -315,13 +729,36 @@ class SmartRunner:
         if self.process and self.process.poll() is None:
             print("[Runner] Killing child process...")
             try:
-                os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+                # start_new_session makes the child its own process group leader
+                os.killpg(self.process.pid, signal.SIGTERM)
             except:
                 pass
         
-        if self.cron_id:
-            print(f"[Runner] Removing cron job: {self.cron_id}")
-            self.run_openclaw_cmd(["cron", "rm", self.cron_id])
+        # A short-lived child can finish before setup_cron; let an in-flight
+        # `cron add` land so its job gets removed instead of orphaned
+        if self._cron_thread is not None and not self._cron_ready.wait(timeout=self.CRON_READY_TIMEOUT):
+            print("[Runner] WARNING: Cron setup still in progress; job may be left behind")
+        with self._cron_lock:
+            cron_id = self.cron_id
+        if cron_id:
+            print(f"[Runner] Removing cron job: {cron_id}")
+            self.run_openclaw_cmd(["cron", "rm", cron_id])
+        
+        if self._log_buf is not None:
+            self.flush_log()
+            self._log_buf.close()
+            os.close(self._log_fd)
+            self._log_buf = None
+        
+        if self.selector:
+            self.selector.close()
+        if self.inotify:
+            self.inotify.close()
+        if self.child_fd is not None:
+            os.close(self.child_fd)
+        for fd in (self._pipe_rfd, self._pipe_wfd):
+            if fd is not None:
+                os.close(fd)
         
         # Clean up named pipe
         if os.path.exists(self.input_pipe):
@@ -338,7 +775,8 @@ if __name__ == "__main__":
     parser.add_argument("--cmd", required=True, help="Command to run")
     parser.add_argument("--name", required=True, help="Cron job name for AI triggering")
     parser.add_argument("--payload", required=True, help="Task description for AI context")
+    parser.add_argument("--shell", action="store_true", help="Run --cmd through /bin/sh (pipes, &&, redirects, ...)")
     args = parser.parse_args()
     
-    runner = SmartRunner(args.cmd, args.name, args.payload, os.getcwd())
-    runner.run()
+    runner = SmartRunner(args.cmd, args.name, args.payload, os.getcwd(), use_shell=args.shell)
+    sys.exit(runner.run())